@@ -1,24 +1,61 @@
 import os
-import re
+import base64
+import mmap
+import codecs
+import errno
+import hashlib
 import sys
 import typing
+import queue
 import platform
+import threading
+import time
 from sys import exit
 from pathlib import Path
 from datetime import datetime
 from configparser import ConfigParser
-from argparse import ArgumentParser
-from urllib.parse import urlparse, urljoin
-from urllib.request import urlopen, urlretrieve
-from json import load
+from argparse import ArgumentParser, ArgumentTypeError
+from contextlib import contextmanager, nullcontext, suppress
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from http.client import HTTPConnection, HTTPSConnection, HTTPResponse, BadStatusLine
+from urllib.parse import urlparse, urljoin, unquote
+from urllib.request import getproxies, proxy_bypass
+from email.utils import parsedate_to_datetime
+from enum import Enum
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+try:
+    from orjson import loads as json_loads
+except ImportError:
+    from json import loads as json_loads
 
 
 APP = "Application"
 IS_WINDOWS = platform.system() == "Windows"
+HAS_DIRECT_IO = hasattr(os, "O_DIRECT") and fcntl is not None
 SERVER_CONFIG_DEFAULT_FILE_NAME: str = "precache-remote-settings.ini"
 LOCAL_CONFIG_DEFAULT_FILE_NAME: str = "precache-local-settings.ini"
 DEFAULT_LOCAL_CACHE_DIRECTORY: str = "./MovieNight"
-STRIP_QUOTES = re.compile('^["\'](.*?)["\']$', re.IGNORECASE)
+DOWNLOAD_CHUNK_SIZE: int = 128 * 1024
+DEFAULT_DOWNLOAD_WORKERS: int = 8
+UNBUFFERED_WRITE_THRESHOLD: int = 16 * 1024 * 1024
+PART_SUFFIX: str = ".part"
+SUPPORTED_SCHEMES = ("http", "https")
+COLOR_ERROR = "\033[31m"
+COLOR_WARN = "\033[33m"
+COLOR_INFO = "\033[34m"
+COLOR_OK = "\033[32m"
+COLOR_RESET = "\033[0m"
+CLEAR_TO_END = "\033[K"
+PROGRESS_INTERVAL: float = 0.1
+OK_COMPLETE = f"{COLOR_OK}Complete.{COLOR_RESET}"
+OK_CACHED = f"{COLOR_OK}Already cached.{COLOR_RESET}"
+ERROR_LABEL = f"{COLOR_ERROR}Error:{COLOR_RESET}"
+NOTICE_LABEL = f"{COLOR_OK}Notice:{COLOR_RESET}"
 
 def main(args):
     parser_result = parse_args(args)
@@ -51,30 +88,85 @@ def main(args):
 
     download_server_uri = download_server + "/" if download_server else ""
     playlist_uri = urljoin(download_server_uri, playlist_config)
-    with urlopen(playlist_uri) as response:
+    playlist_scheme = urlparse(playlist_uri).scheme
+    if playlist_scheme not in SUPPORTED_SCHEMES:
+        fatal(f'Unsupported url scheme "{playlist_scheme}" for "{playlist_uri}", only http and https are supported.')
+    with Session() as session, session.get(playlist_uri) as response:
         if response.getcode() != 200:
             fatal(f'Unable to find the file at "{playlist_uri}". Unable to continue.')
-        playlist_json = load(response)
-
-    if not is_str_list(playlist_json):
-        fatal("Unexpected server response after retrieving json! Expected array of strings.")
-
-    count = 0
-    for filename in playlist_json:
-        # urljoin will replace the original URI with filename if it is a full URI
-        file_uri = urljoin(download_server_uri, filename)
-        basename = os.path.basename(urlparse(file_uri).path)
-        file_path = download_dir / basename
+        # One sized read and a single parse, json.load would decode the stream piece by piece
+        playlist_json = json_loads(response.read())
+
+    if not is_playlist(playlist_json):
+        fatal('Unexpected server response after retrieving json! Expected array of strings or {"file", "sha256"} objects.')
+
+    # Entries sharing a file name write the same .part, so each group of them downloads one after another.
+    # normcase folds the names the way a case-insensitive Windows drive would.
+    groups: 'dict[str, list[tuple[str, str, str|None]]]' = {}
+    for filename, sha256 in map(playlist_entry, playlist_json):
+        file_uri, basename = resolve_download(download_server_uri, filename)
+        # A uri ending in a directory has no file name to save under, it would resolve to the download folder itself
+        if basename in ("", ".", ".."):
+            Logger.error(f' Failed to download "{filename}". The url has no file name.')
+            continue
+        groups.setdefault(os.path.normcase(basename), []).append((file_uri, basename, sha256))
+    # Grouped order is the order a single worker downloads in, the prefetcher has to see the same one
+    downloads = [download for group in groups.values() for download in group]
+    # Connections are not thread-safe, so every worker keeps its own keep-alive session
+    sessions = SessionPool()
+    # The in-place progress line only makes sense when one file downloads at a time.
+    # With a single worker nothing else overlaps the network, so prefetch the next file instead.
+    show_progress = parser_result.jobs == 1
+    # Plain string concatenation per file, instead of a PurePath join and parse for every entry
+    download_prefix = os.path.join(str(download_dir), "")
+    prefetcher = Prefetcher([
+        (file_uri, download_prefix + basename, sha256 is not None) for file_uri, basename, sha256 in downloads
+    ]) if show_progress else None
+
+    # Set on Ctrl-C, running downloads stop at their next chunk instead of finishing the file
+    cancelled = threading.Event()
+
+    def fetch(file_uri: str, basename: str, sha256: 'str|None') -> bool:
+        if cancelled.is_set():
+            return False
+        file_path = download_prefix + basename
 
-        print(f'Downloading "{basename}"...', end="", flush=True)
+        if show_progress:
+            synchronized_print(f'Downloading "{basename}"...', end="", flush=True)
         try:
-            urlretrieve(file_uri, file_path, reporthook=with_name(basename))
+            reporthook = with_name(basename) if show_progress else None
+            session = prefetcher if prefetcher is not None else sessions.get()
+            result = xxx(session, file_uri, file_path, basename, reporthook=reporthook, sha256=sha256, cancelled=cancelled)
+            if result is DownloadResult.FAILED:
+                return False
+        except DownloadCancelled:
+            # Keep the .part, the next run resumes it when the playlist has its checksum
+            return False
         except Exception as ex:
-            try_unlink(file_path)
-            Logger.error(f" Failed to download file. {str(ex)}")
+            # The cached copy under the real name is untouched until a download completes
+            try_unlink(file_path + PART_SUFFIX)
+            Logger.error(f' Failed to download "{basename}". {str(ex)}')
+            return False
+
+        status = OK_CACHED if result is DownloadResult.CACHED else OK_COMPLETE
+        # The progress text can be longer than the status, e.g. "1234.5 MiB", clear what is left of it
+        synchronized_print(f'\rDownloading "{basename}"... {status}{CLEAR_TO_END}')
+        return True
 
-        print(Logger.ok_colored(" Complete."))
-        count += 1
+    def fetch_group(group: 'list[tuple[str, str, str|None]]') -> int:
+        return sum(fetch(*download) for download in group)
+
+    count = 0
+    with sessions, prefetcher or nullcontext(), ThreadPoolExecutor(max_workers=parser_result.jobs) as executor:
+        try:
+            for future in as_completed([executor.submit(fetch_group, group) for group in groups.values()]):
+                count += future.result()
+        except BaseException:
+            # Leaving the with block waits for the workers, drop the queued downloads and
+            # have the running ones stop at their next chunk so Ctrl-C does not wait for whole files
+            cancelled.set()
+            executor.shutdown(wait=False, cancel_futures=True)
+            raise
 
     print(Logger.ok_colored(f"Successfully download {count} of {len(playlist_json)} into cache."))
     input("Press enter to exit.")
@@ -87,8 +179,20 @@ def parse_args(args: 'list[str]'):
         nargs="?",
         default=SERVER_CONFIG_DEFAULT_FILE_NAME,
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        help=f"How many files to download at once. Default {DEFAULT_DOWNLOAD_WORKERS}.",
+        type=positive_int,
+        default=DEFAULT_DOWNLOAD_WORKERS,
+    )
     return parser.parse_args(args)
 
+def positive_int(value: str) -> 'int':
+    number = int(value)
+    if number < 1:
+        raise ArgumentTypeError(f"{value} is not a positive number")
+    return number
+
 def create_local_config_if_not_exists(file_name: str, default_download_dir = DEFAULT_LOCAL_CACHE_DIRECTORY):
     local_config_path = Path(file_name)
     if not local_config_path.exists():
@@ -98,13 +202,147 @@ def create_local_config_if_not_exists(file_name: str, default_download_dir = DEF
         local_config[APP] = {"DownloadDirectory": default_download_dir}
         local_config.write(file_name)
 
-def is_str_list(value: 'typing.Any') -> 'bool':
-    return isinstance(value, list) and all(isinstance(f, str) for f in value)
+def resolve_download(download_server_uri: str, filename: str) -> 'tuple[str, str]':
+    # Plain relative names are the common case and can skip the regex heavy urljoin/urlparse
+    if "://" not in filename and filename[:1] != "/" and "./" not in filename and "?" not in filename and "#" not in filename:
+        basename = filename.rsplit("/", 1)[-1]
+        # "a/.." or "." still need urljoin to collapse the dot segments
+        if basename not in ("", ".", ".."):
+            return download_server_uri + filename, basename
+    # urljoin will replace the original URI with filename if it is a full URI
+    file_uri = urljoin(download_server_uri, filename)
+    return file_uri, os.path.basename(urlparse(file_uri).path)
+
+def split_uri(uri: str) -> 'tuple[str, str, str]':
+    """Splits an absolute uri into scheme, netloc and request path."""
+    scheme, separator, rest = uri.partition("://")
+    if not separator or "#" in rest:
+        parsed = urlparse(uri)
+        path = parsed.path or "/"
+        if parsed.params:
+            path += ";" + parsed.params
+        if parsed.query:
+            path += "?" + parsed.query
+        return parsed.scheme, parsed.netloc, path
+    netloc, slash, path = rest.partition("/")
+    if not slash:
+        netloc, question, query = netloc.partition("?")
+        return scheme.lower(), netloc, "/" + question + query
+    return scheme.lower(), netloc, slash + path
+
+def is_playlist(value: 'typing.Any') -> 'bool':
+    """A playlist holds file names, or {"file": ..., "sha256": ...} objects when the server publishes checksums."""
+    return isinstance(value, list) and all(
+        isinstance(f, str)
+        or (isinstance(f, dict) and isinstance(f.get("file"), str) and isinstance(f.get("sha256", ""), str))
+        for f in value
+    )
 
-def save_buffer_to(buffer: 'typing.IO[bytes]', file_path: 'Path'):
-    with open(file_path, "wb") as f:
-        while chunk := buffer.read(40960):
-            f.write(chunk)
+def playlist_entry(value: 'str|dict[str, str]') -> 'tuple[str, str|None]':
+    if isinstance(value, str):
+        return value, None
+    return value["file"], value.get("sha256") or None
+
+def content_range_start(response: 'HTTPResponse') -> 'int':
+    # Content-Range: bytes <start>-<end>/<total>
+    unit, _, byte_range = (response.getheader("Content-Range") or "").partition(" ")
+    start = byte_range.partition("-")[0]
+    return int(start) if unit == "bytes" and start.isdigit() else -1
+
+def content_length(response: 'HTTPResponse') -> 'int':
+    length = response.getheader("Content-Length")
+    return int(length) if length and length.isdigit() else -1
+
+def save_buffer_to(buffer: 'HTTPResponse', file_path: str, reporthook: 'typing.Callable[[int, int, int], None]|None' = None, digest: 'hashlib._Hash|None' = None, append: bool = False, cancelled: 'threading.Event|None' = None) -> 'int':
+    total_size = content_length(buffer)
+    if HAS_DIRECT_IO and total_size >= UNBUFFERED_WRITE_THRESHOLD:
+        return save_unbuffered_to(buffer, file_path, total_size, reporthook, digest, append, cancelled)
+    count = 0
+    written = 0
+    if reporthook:
+        reporthook(count, DOWNLOAD_CHUNK_SIZE, total_size)
+    # One reused buffer instead of a new bytes object per read; writes this large bypass the file's own buffer
+    with open(file_path, "ab" if append else "wb") as f, memoryview(bytearray(DOWNLOAD_CHUNK_SIZE)) as chunk:
+        while size := read_full(buffer, chunk):
+            if cancelled is not None and cancelled.is_set():
+                raise DownloadCancelled()
+            if digest is not None:
+                digest.update(chunk[:size])
+            f.write(chunk[:size])
+            written += size
+            count += 1
+            if reporthook:
+                reporthook(count, DOWNLOAD_CHUNK_SIZE, total_size)
+    return written
+
+def save_unbuffered_to(buffer: 'HTTPResponse', file_path: str, total_size: int, reporthook: 'typing.Callable[[int, int, int], None]|None' = None, digest: 'hashlib._Hash|None' = None, append: bool = False, cancelled: 'threading.Event|None' = None) -> 'int':
+    """
+    Writes large movies with O_DIRECT so they skip the page cache, they won't be read again until movie night.
+    O_DIRECT needs sector aligned buffers, sizes and offsets, so every write is a full DOWNLOAD_CHUNK_SIZE
+    from a page aligned mmap. The flag is dropped for the unaligned tail, or entirely if the file system refuses it.
+    """
+    # A resumed file usually ends off a sector boundary, its first direct write gets EINVAL and falls back
+    flags = os.O_WRONLY | os.O_CREAT | (os.O_APPEND if append else os.O_TRUNC)
+    try:
+        fd = os.open(file_path, flags | os.O_DIRECT, 0o666)
+        direct = True
+    except OSError as ex:
+        if ex.errno != errno.EINVAL:
+            raise
+        fd = os.open(file_path, flags, 0o666)
+        direct = False
+    try:
+        count = 0
+        written = 0
+        if reporthook:
+            reporthook(count, DOWNLOAD_CHUNK_SIZE, total_size)
+        aligned = mmap.mmap(-1, DOWNLOAD_CHUNK_SIZE)
+        try:
+            with memoryview(aligned) as chunk:
+                while size := read_full(buffer, chunk):
+                    if cancelled is not None and cancelled.is_set():
+                        raise DownloadCancelled()
+                    if digest is not None:
+                        digest.update(chunk[:size])
+                    if direct and size != len(chunk):
+                        direct = drop_direct_io(fd)
+                    try:
+                        write_full(fd, chunk[:size])
+                    except OSError as ex:
+                        if not direct or ex.errno != errno.EINVAL:
+                            raise
+                        direct = drop_direct_io(fd)
+                        write_full(fd, chunk[:size])
+                    written += size
+                    count += 1
+                    if reporthook:
+                        reporthook(count, DOWNLOAD_CHUNK_SIZE, total_size)
+        finally:
+            # A traceback from a failed read or write still holds slices of the map, closing it then raises
+            # BufferError over the real error. The map is freed along with those slices anyway.
+            with suppress(BufferError):
+                aligned.close()
+        return written
+    finally:
+        os.close(fd)
+
+def drop_direct_io(fd: int) -> 'bool':
+    fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) & ~os.O_DIRECT)
+    return False
+
+def read_full(buffer: 'HTTPResponse', chunk: 'memoryview') -> 'int':
+    filled = 0
+    while filled < len(chunk):
+        size = buffer.readinto(chunk[filled:])
+        if not size:
+            break
+        filled += size
+    return filled
+
+def write_full(fd: int, chunk: 'memoryview'):
+    written = 0
+    while written < len(chunk):
+        written += os.write(fd, chunk[written:])
 
 def try_unlink(file_path: 'str|bytes|os.PathLike[str]|os.PathLike[bytes]'):
     try:
@@ -112,22 +350,94 @@ def try_unlink(file_path: 'str|bytes|os.PathLike[str]|os.PathLike[bytes]'):
     except IOError:
         pass
 
-def xxx(file_uri: str, file_path: 'Path', basename: str):
-    with urlopen(file_uri) as response:
-        if response.getcode() != 200:
-            print(f" {Logger.error_colored("Error:")} Failed to download file")
-            if file_path.exists():
-                print(f' {Logger.ok_colored("Notice:")} Deleting previous pre-cached file "{basename}"')
-                try_unlink(file_path)
-            return False
-        save_buffer_to(response, file_path)
-        return True
+def xxx(session: 'Session|Prefetcher', file_uri: str, file_path: str, basename: str, reporthook = None, sha256: 'str|None' = None, cancelled: 'threading.Event|None' = None) -> 'DownloadResult':
+    with session.get_if_changed(file_uri, file_path, resumable=sha256 is not None) as response:
+        if response is None:
+            return DownloadResult.CACHED
+        part_path = file_path + PART_SUFFIX
+        if response.getcode() not in (200, 206):
+            synchronized_print(f' {ERROR_LABEL} Failed to download "{basename}"')
+            try_unlink(part_path)
+            # One unlink instead of exists() and unlink, and no window for the file to vanish in between
+            try:
+                os.unlink(file_path)
+            except FileNotFoundError:
+                pass
+            else:
+                synchronized_print(f' {NOTICE_LABEL} Deleted previous pre-cached file "{basename}"')
+            return DownloadResult.FAILED
+        # 206 means the server honoured the Range for a leftover .part, append the rest to it
+        append = response.getcode() == 206
+        # Hashing the chunks on their way to disk costs nothing next to the download, re-reading the file would.
+        # Only a resumed download has to hash what is already on disk.
+        digest = None
+        if sha256:
+            if append:
+                with open(part_path, "rb") as f:
+                    digest = hashlib.file_digest(f, "sha256")
+            else:
+                digest = hashlib.sha256()
+        written = save_buffer_to(response, part_path, reporthook, digest, append, cancelled)
+        verify_download(response, written, digest, sha256)
+        keep_modified_time(response, part_path)
+        # Only a complete, verified file ever shows up under the real name
+        os.replace(part_path, file_path)
+        return DownloadResult.DOWNLOADED
+
+def verify_download(response: 'HTTPResponse', written: int, digest: 'hashlib._Hash|None', sha256: 'str|None'):
+    total_size = content_length(response)
+    if total_size >= 0 and written != total_size:
+        raise RuntimeError(f"Downloaded {written} bytes, expected {total_size} bytes.")
+    if digest is not None and sha256 is not None and digest.hexdigest() != sha256.lower():
+        raise RuntimeError(f"Checksum mismatch, expected sha256 {sha256}.")
+
+def last_modified(response: 'HTTPResponse') -> 'int|None':
+    value = response.getheader("Last-Modified")
+    if not value:
+        return None
+    try:
+        return int(parsedate_to_datetime(value).timestamp())
+    except (TypeError, ValueError):
+        return None
+
+def matches_local_copy(response: 'HTTPResponse', stat: 'os.stat_result') -> 'bool':
+    if content_length(response) != stat.st_size:
+        return False
+    modified = last_modified(response)
+    return modified is None or modified == int(stat.st_mtime)
+
+def keep_modified_time(response: 'HTTPResponse', file_path: str):
+    # Stamp the server's time on the copy, the next run compares it to skip unchanged files
+    modified = last_modified(response)
+    if modified is not None:
+        os.utime(file_path, (modified, modified))
 
 def with_name(name):
+    # Only the number changes between calls, build the rest of the line once per file
+    prefix = f"\rDownloading \"{name}\"... "
+    last_update = 0.0
     def download_hook(count: int, block_size: int, total_size: int):
-        print(f"\rDownloading \"{name}\"... {round(count * block_size / total_size * 100.0, 2):.2f}%", end="", flush=True)
+        nonlocal last_update
+        # Every flushed print is a console write, Windows consoles are slow enough for that to show
+        now = time.monotonic()
+        if now - last_update < PROGRESS_INTERVAL:
+            return
+        last_update = now
+        downloaded = count * block_size
+        # Chunked responses have no Content-Length, report the size instead of a percentage
+        if total_size <= 0:
+            synchronized_print(f"{prefix}{downloaded / 1048576:.1f} MiB", end="", flush=True)
+            return
+        percent = min(downloaded, total_size) / total_size * 100.0
+        synchronized_print(f"{prefix}{percent:.2f}%", end="", flush=True)
     return download_hook
 
+_print_lock = threading.Lock()
+
+def synchronized_print(*values: 'typing.Any', **kwargs: 'typing.Any'):
+    with _print_lock:
+        print(*values, **kwargs)
+
 def fatal(message, ex: Exception|None = None):
     Logger.error(f"Failed to precache items. {message}")
     if ex:
@@ -135,48 +445,339 @@ def fatal(message, ex: Exception|None = None):
     input("Press enter to exit.")
     exit(1)
 
+class Session:
+    """Keeps one keep-alive connection per host, so only the first download pays for the TCP/TLS handshake."""
+    _MAX_REDIRECTS = 5
+
+    def __init__(self):
+        # Per host: the connection, the prefix for the request target and headers every request needs
+        self._connections: 'dict[tuple[str, str], tuple[HTTPConnection, str, dict[str, str]]]' = {}
+        # urlopen honoured HTTP(S)_PROXY and the Windows proxy settings, so do the same
+        self._proxies = getproxies()
+
+    def _connection(self, scheme: str, netloc: str) -> 'tuple[HTTPConnection, str, dict[str, str]]':
+        key = (scheme, netloc)
+        entry = self._connections.get(key)
+        if entry is None:
+            entry = self._connections[key] = self._open(scheme, netloc)
+        return entry
+
+    def _open(self, scheme: str, netloc: str) -> 'tuple[HTTPConnection, str, dict[str, str]]':
+        if scheme not in SUPPORTED_SCHEMES:
+            raise ValueError(f'Unsupported url scheme "{scheme}", only http and https can be downloaded.')
+        proxy = self._proxies.get(scheme)
+        if not proxy or proxy_bypass(netloc):
+            return (HTTPSConnection(netloc) if scheme == "https" else HTTPConnection(netloc)), "", {}
+        if "://" not in proxy:
+            proxy = "http://" + proxy
+        parsed_proxy = urlparse(proxy)
+        if parsed_proxy.scheme != "http":
+            raise ValueError(f'Unsupported proxy "{proxy}", only http:// proxies are supported.')
+        proxy_headers = {}
+        if parsed_proxy.username:
+            credentials = f"{unquote(parsed_proxy.username)}:{unquote(parsed_proxy.password or '')}"
+            proxy_headers["Proxy-Authorization"] = "Basic " + base64.b64encode(credentials.encode()).decode("ascii")
+        proxy_netloc = parsed_proxy.netloc.rpartition("@")[2]
+        if scheme == "https":
+            # CONNECT through the proxy, TLS still goes end to end to the real host
+            conn = HTTPSConnection(proxy_netloc)
+            conn.set_tunnel(netloc, headers=proxy_headers)
+            return conn, "", {}
+        # Plain http goes to the proxy with the absolute uri as the request target
+        return HTTPConnection(proxy_netloc), f"http://{netloc}", proxy_headers
+
+    def _drop(self, scheme: str, netloc: str):
+        entry = self._connections.pop((scheme, netloc), None)
+        if entry is not None:
+            entry[0].close()
+
+    def request(self, method: str, uri: str, headers: 'dict[str, str]|None' = None) -> 'HTTPResponse':
+        for _ in range(self._MAX_REDIRECTS):
+            scheme, netloc, path = split_uri(uri)
+            response = self._send(scheme, netloc, method, path, headers or {})
+            location = response.getheader("Location")
+            if response.status not in (301, 302, 303, 307, 308) or not location:
+                return response
+            response.read()
+            uri = urljoin(uri, location)
+        raise RuntimeError(f'Too many redirects for "{uri}".')
+
+    def _send(self, scheme: str, netloc: str, method: str, path: str, headers: 'dict[str, str]') -> 'HTTPResponse':
+        try:
+            conn, target, extra_headers = self._connection(scheme, netloc)
+            conn.request(method, target + path, headers={**headers, **extra_headers})
+            return conn.getresponse()
+        except (BadStatusLine, ConnectionError):
+            # The server closed the idle keep-alive socket (RemoteDisconnected is both); retry once on a fresh one
+            self._drop(scheme, netloc)
+            conn, target, extra_headers = self._connection(scheme, netloc)
+            conn.request(method, target + path, headers={**headers, **extra_headers})
+            return conn.getresponse()
+
+    def connect(self, uri: str):
+        """Opens the connection for uri ahead of the first request on it."""
+        scheme, netloc, _ = split_uri(uri)
+        conn = self._connection(scheme, netloc)[0]
+        if conn.sock is None:
+            conn.connect()
+
+    def get(self, uri: str, headers: 'dict[str, str]|None' = None):
+        return self.receive(self.request("GET", uri, headers))
+
+    def get_if_changed(self, uri: str, file_path: str, resumable: bool = False):
+        """Same as get, but yields None instead of downloading when file_path already matches the server."""
+        return self.receive(self.request_if_changed(uri, file_path, resumable))
+
+    def request_if_changed(self, uri: str, file_path: str, resumable: bool = False) -> 'HTTPResponse|None':
+        if self.is_unchanged(uri, file_path):
+            return None
+        return self.request_download(uri, file_path, resumable)
+
+    def is_unchanged(self, uri: str, file_path: str) -> bool:
+        try:
+            stat = os.stat(file_path)
+        except FileNotFoundError:
+            return False
+        # A HEAD is one header exchange on the open connection, the GET could be gigabytes
+        head = self.request("HEAD", uri)
+        head.read()
+        return head.status == 200 and matches_local_copy(head, stat)
+
+    def request_download(self, uri: str, file_path: str, resumable: bool = False) -> 'HTTPResponse':
+        part_path = file_path + PART_SUFFIX
+        if not resumable:
+            try_unlink(part_path)
+            return self.request("GET", uri)
+        return self.request_resume(uri, part_path)
+
+    def request_resume(self, uri: str, part_path: str) -> 'HTTPResponse':
+        """
+        GETs uri, continuing from the end of a .part file an interrupted run left behind.
+        Nothing records which version of the file the .part came from, so a changed file would be spliced
+        onto the old prefix; only call this when the playlist's sha256 will catch that.
+        """
+        try:
+            resume_from = os.stat(part_path).st_size
+        except FileNotFoundError:
+            resume_from = 0
+        if not resume_from:
+            return self.request("GET", uri)
+        response = self.request("GET", uri, {"Range": f"bytes={resume_from}-"})
+        if response.status == 206 and content_range_start(response) == resume_from:
+            return response
+        if response.status not in (206, 416):
+            return response
+        # The server's copy is no longer than what we have, or it answered a different range; start over
+        response.read()
+        try_unlink(part_path)
+        return self.request("GET", uri)
+
+    @contextmanager
+    def receive(self, response: 'HTTPResponse|None'):
+        if response is None:
+            yield None
+            return
+        try:
+            yield response
+            # Drain whatever the caller left unread, otherwise the next request on this socket reads garbage
+            response.read()
+        except BaseException:
+            # The socket may hold a half-read body; it cannot be reused
+            self.close()
+            raise
+        finally:
+            response.close()
+
+    def close(self):
+        for conn, _, _ in self._connections.values():
+            conn.close()
+        self._connections.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class Prefetcher:
+    """
+    Gets the next file ready while the current one is still being written, so the server's time to
+    first byte overlaps the disk write. Two sessions take turns; a session only goes back to the
+    prefetch thread once its response has been fully read.
+    The connection and the HEAD for the next file happen right away, neither goes stale. The GET waits
+    until the current body is almost read, servers drop a response that nobody reads for too long.
+    """
+    _DEPTH = 2
+    # How much of the current body may be left when the next GET goes out
+    _WINDOW = 16 * DOWNLOAD_CHUNK_SIZE
+    _POLL_INTERVAL = 0.05
+
+    def __init__(self, downloads: 'list[tuple[str, str, bool]]'):
+        self._free: 'queue.Queue[Session|None]' = queue.Queue()
+        self._ready: 'queue.Queue[tuple[str, Session, HTTPResponse|None, Exception|None]]' = queue.Queue()
+        self._sessions = [Session() for _ in range(self._DEPTH)]
+        for session in self._sessions:
+            self._free.put(session)
+        # Guards how many downloads are done and the response being read right now
+        self._turn = threading.Condition()
+        self._done = 0
+        self._current: 'HTTPResponse|None' = None
+        self._closed = False
+        self._thread = threading.Thread(target=self._prefetch, args=(downloads,), daemon=True)
+        self._thread.start()
+
+    def _prefetch(self, downloads: 'list[tuple[str, str, bool]]'):
+        for index, (uri, file_path, resumable) in enumerate(downloads):
+            session = self._free.get()
+            if session is None:
+                return
+            try:
+                session.connect(uri)
+                if session.is_unchanged(uri, file_path):
+                    response = None
+                elif self._wait_for_turn(index):
+                    response = session.request_download(uri, file_path, resumable)
+                else:
+                    return
+                self._ready.put((uri, session, response, None))
+            except Exception as ex:
+                session.close()
+                self._ready.put((uri, session, None, ex))
+
+    def _wait_for_turn(self, index: int) -> bool:
+        """Blocks until the download before index is done or has at most _WINDOW left, False once closed."""
+        with self._turn:
+            while not self._closed:
+                if self._done >= index:
+                    return True
+                current = self._current
+                # length counts down while the body is read; a chunked body has none and must finish first
+                if self._done == index - 1 and current is not None and current.length is not None and current.length <= self._WINDOW:
+                    return True
+                # Reading the body doesn't notify, so look again every so often
+                self._turn.wait(self._POLL_INTERVAL)
+            return False
+
+    @contextmanager
+    def get_if_changed(self, uri: str, file_path: str, resumable: bool = False):
+        prefetched_uri, session, response, error = self._ready.get()
+        try:
+            if prefetched_uri != uri:
+                raise RuntimeError(f'Expected "{prefetched_uri}" to be downloaded next, got "{uri}".')
+            if error is not None:
+                raise error
+            with self._turn:
+                self._current = response
+            with session.receive(response) as response:
+                yield response
+        finally:
+            with self._turn:
+                self._current = None
+                self._done += 1
+                self._turn.notify_all()
+            self._free.put(session)
+
+    def close(self):
+        with self._turn:
+            self._closed = True
+            self._turn.notify_all()
+        self._free.put(None)
+        self._thread.join()
+        for session in self._sessions:
+            session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class SessionPool:
+    """Hands every thread its own Session and closes all of them on exit."""
+
+    def __init__(self):
+        self._local = threading.local()
+        self._sessions: 'list[Session]' = []
+        self._lock = threading.Lock()
+
+    def get(self) -> 'Session':
+        session = getattr(self._local, "session", None)
+        if session is None:
+            session = self._local.session = Session()
+            with self._lock:
+                self._sessions.append(session)
+        return session
+
+    def close(self):
+        with self._lock:
+            for session in self._sessions:
+                session.close()
+            self._sessions.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+class DownloadCancelled(Exception):
+    """Raised between chunks once Ctrl-C was pressed, the .part is left behind for the next run."""
+
+class DownloadResult(Enum):
+    FAILED = "failed"
+    DOWNLOADED = "downloaded"
+    CACHED = "cached"
+
 class Config:
-    _WELL_DEFINED_ENCODING = [
-        ("utf-8-sig", b"\xef\xbb\xbf"),
-        ("utf-16-le", b"\xff\xfe"),
-        ("utf-16-be", b"\xfe\xff"),
-        ("utf-32-le", b"\xff\xfe\x00\x00"),
-        ("utf-32-be", b"\x00\x00\xfe\xff"),
-    ]
-
-    def _detect_known_encoding(self, file_path: str):
-        with open(file_path, "rb") as f:
-            raw_bytes = f.read(4)
-        for encoding, bom in self._WELL_DEFINED_ENCODING:
-            if raw_bytes.startswith(bom):
+    # The utf-16 and utf-32 codecs read the BOM to pick the byte order and strip it,
+    # the -le/-be variants would leave a U+FEFF in front of the first section header.
+    _BOM_TABLE: 'dict[bytes, str]' = {
+        codecs.BOM_UTF32_LE: "utf-32",
+        codecs.BOM_UTF32_BE: "utf-32",
+        codecs.BOM_UTF8: "utf-8-sig",
+        codecs.BOM_UTF16_LE: "utf-16",
+        codecs.BOM_UTF16_BE: "utf-16",
+    }
+
+    def _detect_known_encoding(self, raw_bytes: bytes):
+        # Longest first, the utf-32-le BOM starts with the utf-16-le one
+        for length in (4, 3, 2):
+            encoding = self._BOM_TABLE.get(raw_bytes[:length])
+            if encoding:
                 return encoding
         return ""
 
+    def _decode(self, data: bytes):
+        # utf-8 covers the ASCII encoding space, nothing else to try
+        if data.isascii():
+            return data.decode("ascii")
+        file_hint = self._detect_known_encoding(data[:4])
+        # These do not contain a BOM
+        possible_encodings = ["utf-8", "utf-16", "cp1252"]
+        if file_hint:
+            possible_encodings.insert(0, file_hint)
+        for encoding in possible_encodings:
+            try:
+                return data.decode(encoding)
+            except UnicodeError:
+                pass
+        return None
+
     def _try_read(self, *files: str):
         for file in files:
-            success = False
-            file_hint = self._detect_known_encoding(file)
-            # utf-8 covers the ASCII encoding space. These do not contain a BOM
-            possible_encodings = ["utf-8", "utf-16", "cp1252"]
-            if file_hint:
-                possible_encodings.insert(0, file_hint)
-            for encoding in possible_encodings:
-                try:
-                    self.config.read(file, encoding=encoding)
-                    success=True
-                    break
-                except UnicodeError:
-                    pass
-            if not success:
+            with open(file, "rb") as f:
+                text = self._decode(f.read())
+            if text is None:
                 raise RuntimeError("Unable to read config file.")
+            self.config.read_string(text, source=file)
 
     @staticmethod
     def _maybe_str_lit(value: str | None):
         if value is None:
             return None
         value = str(value)
-        if m := STRIP_QUOTES.match(value) is not None:
-            return m.group(1)
+        if len(value) >= 2 and value[0] == value[-1] and value[0] in ("'", '"'):
+            return value[1:-1]
         return value
 
     def __init__(self, config = None):
@@ -200,37 +801,43 @@ class Config:
             self.config.write(f)
 
 class Logger:
+    # print's separator supplies the space, so a log line is just the prefix and the message
+    _INFO_PREFIX = f"{COLOR_INFO}[INFO]{COLOR_RESET}"
+    _ERROR_PREFIX = f"{COLOR_ERROR}[ERROR]{COLOR_RESET}"
+    _WARN_PREFIX = f"{COLOR_WARN}[WARN]{COLOR_RESET}"
+    _OK_PREFIX = f"{COLOR_OK}[OK]{COLOR_RESET}"
+
     @staticmethod
     def info(message):
-        print(str.format("{0} {1}", Logger.info_colored("[INFO]"), message))
+        synchronized_print(Logger._INFO_PREFIX, message)
 
     @staticmethod
     def error(message):
-        print(str.format("{0} {1}", Logger.error_colored("[ERROR]"), message))
+        synchronized_print(Logger._ERROR_PREFIX, message)
 
     @staticmethod
     def warning(message):
-        print(str.format("{0} {1}", Logger.warn_colored("[WARN]"), message))
+        synchronized_print(Logger._WARN_PREFIX, message)
 
     @staticmethod
     def success(message):
-        print(str.format("{0} {1}", Logger.ok_colored("[OK]"), message))
+        synchronized_print(Logger._OK_PREFIX, message)
 
     @staticmethod
     def error_colored(string: str):
-        return f"\033[31m{string}\033[0m"
+        return f"{COLOR_ERROR}{string}{COLOR_RESET}"
 
     @staticmethod
     def warn_colored(string: str):
-        return f"\033[33m{string}\033[0m"
+        return f"{COLOR_WARN}{string}{COLOR_RESET}"
 
     @staticmethod
     def info_colored(string: str):
-        return f"\033[34m{string}\033[0m"
+        return f"{COLOR_INFO}{string}{COLOR_RESET}"
 
     @staticmethod
     def ok_colored(string: str):
-        return f"\033[32m{string}\033[0m"
+        return f"{COLOR_OK}{string}{COLOR_RESET}"
 
 
 if __name__ == "__main__":